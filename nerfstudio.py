@@ -1,17 +1,22 @@
 #!/usr/bin/env python3
-import subprocess
+import asyncio
+import codecs
 import time
 import json
 import os
+import sys
 import shlex
-from datetime import datetime
-from typing import List
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Tuple, Union
 
 
 class NerfTrainingLogger:
     def __init__(self):
         self.conda_env = "nerfstudio"
         self.conda_path = "/home/sebastian/miniconda3/bin/conda"
+        self._conda_prefix = None
 
     def check_conda_environment(self):
         """Check if we're in the correct conda environment"""
@@ -29,30 +34,135 @@ class NerfTrainingLogger:
 
     def get_conda_command_prefix(self):
         """Get the command prefix to run commands in conda environment"""
+        # The environment cannot change within a process, so only check it once
+        if self._conda_prefix is not None:
+            return self._conda_prefix
+
         if self.check_conda_environment():
-            return []
+            self._conda_prefix = []
+            return self._conda_prefix
         else:
             print("PANIC! You are not in the nerfstudio conda environment!")
             exit(-1)
             return [self.conda_path, 'run', '-n', self.conda_env]
             # return ["source /home/sebastian/miniconda3/etc/profile.d/conda.sh;", "conda activate nerfstudio;"]
 
-    def export_gaussian_splat(self, config_path: str, output_dir: str) -> bool:
-        """Export gaussian splat from trained splatfacto model"""
+    async def _stream_process(self, cmd: List[str], f, tee: bool = True, collect: bool = False) -> int:
+        """Run a command, tee its combined stdout/stderr to the console and the log file f
+
+        With tee=False the output only goes to the log file. If collect is also set, it is gathered in memory and
+        written once the process has exited, which only suits short-running commands.
+        """
+        # Pass the output through as raw bytes rather than decoding and re-encoding it line by line.
+        # Flush the text layers first so the output stays in order with what was written before.
+        sys.stdout.flush()
+        f.flush()
+        log = f.buffer
+
+        # Text-only stdouts (Jupyter's output stream, StringIO or redirect_stdout targets) have no binary buffer,
+        # decode for those instead
+        console = getattr(sys.stdout, 'buffer', None)
+        decoder = None if console is not None else codecs.getincrementaldecoder('utf-8')(errors='replace')
+
+        # Own process group, so a failure below can take down the command together with anything it spawned
+        process = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+
+        try:
+            if not tee and collect:
+                output, _ = await process.communicate()
+                log.write(output)
+                return process.returncode
+
+            # The event loop reads the pipe non-blocking as soon as data is available, so a silent process does not
+            # block anything and a burst of output is handed over as a single chunk
+            while True:
+                chunk = await process.stdout.read(65536)
+                if not chunk:
+                    break
+                if tee:
+                    if decoder is None:
+                        console.write(chunk)
+                        console.flush()
+                    else:
+                        sys.stdout.write(decoder.decode(chunk))
+                        sys.stdout.flush()
+                log.write(chunk)
+
+            if tee and decoder is not None:
+                sys.stdout.write(decoder.decode(b'', final=True))
+                sys.stdout.flush()
+
+            return await process.wait()
+        except BaseException:
+            # Never leave the command running unattended when pumping its output fails. Kill the whole group:
+            # children still holding the pipe (conda run, dataloader workers, ...) would otherwise keep wait() from
+            # returning. Bound the wait in case one of them escaped the group.
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            try:
+                await asyncio.wait_for(process.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                pass
+            raise
+
+    def _run_logged(self, cmd: List[str], log_file: Path, header_lines: List[str],
+                    tee: bool = True, collect: bool = False) -> Tuple[int, float]:
+        """Run a command with its output tee'd to log_file, return its exit code and duration in seconds"""
+        start_time = time.monotonic()
+
+        with open(log_file, 'w') as f:
+            for header_line in header_lines:
+                f.write(f"{header_line}\n")
+            f.write(f"Conda Environment: {self.conda_env}\n")
+            f.write(f"{'=' * 50}\n\n")
+
+            def run() -> int:
+                return asyncio.run(self._stream_process(cmd, f, tee, collect))
+
+            try:
+                try:
+                    asyncio.get_running_loop()
+                except RuntimeError:
+                    returncode = run()
+                else:
+                    # Called from inside an event loop (e.g. Jupyter), where asyncio.run needs a thread of its own
+                    with ThreadPoolExecutor(max_workers=1) as executor:
+                        returncode = executor.submit(run).result()
+            except Exception as e:
+                f.write(f"\nEXCEPTION: {e}\n")
+                raise
+
+            duration = time.monotonic() - start_time
+
+            f.write(f"\n{'=' * 50}\n")
+            f.write(f"Duration: {duration:.2f}s ({duration / 60:.2f} minutes)\n")
+            f.write(f"Return code: {returncode}\n")
+
+        return returncode, duration
+
+    def export_gaussian_splat(self, config_path: Union[str, Path], output_dir: Union[str, Path],
+                              tee: bool = True) -> bool:
+        """Export gaussian splat from trained splatfacto model, with tee=False ns-export output only goes to the log"""
+
+        config_file = Path(config_path)
+        out_dir = Path(output_dir)
 
         # Validate config file exists
-        if not os.path.exists(config_path):
+        if not config_file.is_file():
             print(f"Config file not found: {config_path}")
             return False
 
         # Create output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
+        out_dir.mkdir(parents=True, exist_ok=True)
 
         # Build ns-export command
         export_cmd = [
             "ns-export", "gaussian-splat",
-            "--load-config", config_path,
-            "--output-dir", output_dir
+            "--load-config", str(config_file),
+            "--output-dir", str(out_dir)
         ]
 
         # Get conda command prefix if needed
@@ -61,80 +171,63 @@ class NerfTrainingLogger:
             cmd = conda_prefix + export_cmd
         else:
             cmd = export_cmd
+        cmd_str = shlex.join(cmd)
 
         # Create log file for export
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_file = os.path.join(output_dir, f"gaussian_export_{timestamp}.log")
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        log_file = out_dir / f"gaussian_export_{timestamp}.log"
 
         print(f"Starting gaussian splat export...")
         print(f"Config: {config_path}")
         print(f"Output directory: {output_dir}")
-        print(f"Command: {' '.join(cmd)}")
-
-        start_time = time.time()
+        print(f"Command: {cmd_str}")
 
         try:
-            with open(log_file, 'w') as f:
-                f.write(f"=== GAUSSIAN SPLAT EXPORT START ===\n")
-                f.write(f"Command: {' '.join(cmd)}\n")
-                f.write(f"Config: {config_path}\n")
-                f.write(f"Output Directory: {output_dir}\n")
-                f.write(f"Conda Environment: {self.conda_env}\n")
-                f.write(f"{'=' * 50}\n\n")
-
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, executable="/bin/bash", shell=True,
-                                           universal_newlines=True, bufsize=1)
-
-                for line in process.stdout:
-                    print(line, end='')
-                    f.write(line)
-                    f.flush()
-
-            process.wait()
-            end_time = time.time()
-            duration = end_time - start_time
-
-            with open(log_file, 'a') as f:
-                f.write(f"\n{'=' * 50}\n")
-                f.write(f"Duration: {duration:.2f}s\n")
-                f.write(f"Return code: {process.returncode}\n")
+            returncode, duration = self._run_logged(cmd, log_file, [
+                "=== GAUSSIAN SPLAT EXPORT START ===",
+                f"Command: {cmd_str}",
+                f"Config: {config_path}",
+                f"Output Directory: {output_dir}",
+            ], tee, collect=True)
 
             print(f"\nGaussian splat export completed in {duration:.2f}s")
             print(f"Export logs saved to: {log_file}")
 
-            if process.returncode == 0:
+            if returncode == 0:
                 print(f"Gaussian splat successfully exported to: {output_dir}")
                 # Look for common output files
-                ply_files = [f for f in os.listdir(output_dir) if f.endswith('.ply')]
+                with os.scandir(out_dir) as entries:
+                    ply_files = [e.name for e in entries if e.name.endswith('.ply')]
                 if ply_files:
                     print(f"Generated PLY files: {ply_files}")
 
-            return process.returncode == 0
+            return returncode == 0
 
         except Exception as e:
             print(f"Gaussian splat export failed: {e}")
-            with open(log_file, 'a') as f:
-                f.write(f"\nEXCEPTION: {e}\n")
             return False
 
-    def export_pointcloud(self, config_path: str, output_dir: str, num_points: int = 1000000,
-                          remove_outliers: bool = True, normal_method: str = "open3d",
-                          save_world_frame: bool = False) -> bool:
-        """Export pointcloud from trained nerfacto model"""
+    def export_pointcloud(self, config_path: Union[str, Path], output_dir: Union[str, Path],
+                          num_points: int = 1000000, remove_outliers: bool = True, normal_method: str = "open3d",
+                          save_world_frame: bool = False, tee: bool = True) -> bool:
+        """Export pointcloud from trained nerfacto model, with tee=False ns-export output only goes to the log"""
+
+        config_file = Path(config_path)
+        out_dir = Path(output_dir)
 
         # Validate config file exists
-        if not os.path.exists(config_path):
+        if not config_file.is_file():
             print(f"Config file not found: {config_path}")
             return False
 
         # Create output directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
+        out_dir.mkdir(parents=True, exist_ok=True)
 
         # Build ns-export command
         export_cmd = [
             "ns-export", "pointcloud",
-            "--load-config", config_path,
-            "--output-dir", output_dir,
+            "--load-config", str(config_file),
+            "--output-dir", str(out_dir),
             "--num-points", str(num_points),
             "--remove-outliers", str(remove_outliers),
             "--normal-method", normal_method,
@@ -147,10 +240,11 @@ class NerfTrainingLogger:
             cmd = conda_prefix + export_cmd
         else:
             cmd = export_cmd
+        cmd_str = shlex.join(cmd)
 
         # Create log file for export
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        log_file = os.path.join(output_dir, f"pointcloud_export_{timestamp}.log")
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        log_file = out_dir / f"pointcloud_export_{timestamp}.log"
 
         print(f"Starting pointcloud export...")
         print(f"Config: {config_path}")
@@ -159,82 +253,86 @@ class NerfTrainingLogger:
         print(f"Remove outliers: {remove_outliers}")
         print(f"Normal method: {normal_method}")
         print(f"Save world frame: {save_world_frame}")
-        print(f"Command: {' '.join(cmd)}")
-
-        start_time = time.time()
+        print(f"Command: {cmd_str}")
 
         try:
-            with open(log_file, 'w') as f:
-                f.write(f"=== POINTCLOUD EXPORT START ===\n")
-                f.write(f"Command: {' '.join(cmd)}\n")
-                f.write(f"Config: {config_path}\n")
-                f.write(f"Output Directory: {output_dir}\n")
-                f.write(f"Number of points: {num_points}\n")
-                f.write(f"Remove outliers: {remove_outliers}\n")
-                f.write(f"Normal method: {normal_method}\n")
-                f.write(f"Save world frame: {save_world_frame}\n")
-                f.write(f"Conda Environment: {self.conda_env}\n")
-                f.write(f"{'=' * 50}\n\n")
-
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                           universal_newlines=True, bufsize=1)
-
-                for line in process.stdout:
-                    print(line, end='')
-                    f.write(line)
-                    f.flush()
-
-            process.wait()
-            end_time = time.time()
-            duration = end_time - start_time
-
-            with open(log_file, 'a') as f:
-                f.write(f"\n{'=' * 50}\n")
-                f.write(f"Duration: {duration:.2f}s\n")
-                f.write(f"Return code: {process.returncode}\n")
+            returncode, duration = self._run_logged(cmd, log_file, [
+                "=== POINTCLOUD EXPORT START ===",
+                f"Command: {cmd_str}",
+                f"Config: {config_path}",
+                f"Output Directory: {output_dir}",
+                f"Number of points: {num_points}",
+                f"Remove outliers: {remove_outliers}",
+                f"Normal method: {normal_method}",
+                f"Save world frame: {save_world_frame}",
+            ], tee, collect=True)
 
             print(f"\nPointcloud export completed in {duration:.2f}s")
             print(f"Export logs saved to: {log_file}")
 
-            if process.returncode == 0:
+            if returncode == 0:
                 print(f"Pointcloud successfully exported to: {output_dir}")
                 # Look for common output files
-                ply_files = [f for f in os.listdir(output_dir) if f.endswith('.ply')]
+                with os.scandir(out_dir) as entries:
+                    ply_files = [e.name for e in entries if e.name.endswith('.ply')]
                 if ply_files:
                     print(f"Generated PLY files: {ply_files}")
 
-            return process.returncode == 0
+            return returncode == 0
 
         except Exception as e:
             print(f"Pointcloud export failed: {e}")
-            with open(log_file, 'a') as f:
-                f.write(f"\nEXCEPTION: {e}\n")
             return False
 
     def train_simple(self, method: str, base_dir: str, experiment_name: str, config: List[str],
-                     dataparser: str = "nerfstudio-data", export_geometry: bool = True, quit_viewer: bool = False):
-        """Simple training using conda run with optional gaussian splat export"""
+                     dataparser: str = "nerfstudio-data", export_geometry: bool = True, quit_viewer: bool = False,
+                     tee: bool = True):
+        """Simple training using conda run with optional gaussian splat export
+
+        config holds extra ns-train arguments as separate tokens, e.g. ["--downscale-factor", "4"].
+        The older form with one space-delimited string per option, e.g. ["--downscale-factor 4"], is deprecated
+        but still accepted: option entries containing whitespace are split with shlex (falling back to a plain
+        whitespace split on unbalanced quotes), value entries such as paths with spaces are kept as they are.
+        With tee=False the output of ns-train and ns-export is only written to the log files. The training log is
+        still written while ns-train runs, the export logs once each export has finished.
+        """
 
         # Construct data path
-        data_path = os.path.join(base_dir, "nerf/nerf_data")
+        data_path = Path(base_dir) / "nerf" / "nerf_data"
 
         # Separate dataparser-specific parameters from general config
         dataparser_params = []
         general_config = []
 
+        def is_legacy_option(param: str) -> bool:
+            """Deprecated form: an option and its values in one whitespace-delimited string"""
+            return param.startswith("--") and any(c.isspace() for c in param)
+
+        tokens = []
         for param in config:
-            if param.startswith("--downscale-factor"):
-                dataparser_params.extend(param.split())
+            if is_legacy_option(param):
+                try:
+                    tokens.extend(shlex.split(param))
+                except ValueError:
+                    # Unbalanced quotes, e.g. "--name it's"
+                    tokens.extend(param.split())
             else:
-                general_config.extend(param.split())
+                tokens.append(param)
+
+        # Each option starts a new group, its values follow until the next option
+        target = general_config
+        for token in tokens:
+            if token.startswith("--"):
+                target = dataparser_params if token.startswith("--downscale-factor") else general_config
+            target.append(token)
 
         # Build ns-train command
         ns_cmd = [
             "ns-train", method,
-            "--data", data_path,
+            "--data", str(data_path),
             "--method-name", method,
             "--experiment_name", experiment_name,
-            "--output-dir", data_path,
+            "--output-dir", str(data_path),
             "--viewer.quit-on-train-completion", str(quit_viewer),
             "--logging.steps-per-log", "100",
             "--logging.local-writer.max-log-size", "0"
@@ -250,17 +348,17 @@ class NerfTrainingLogger:
         ns_cmd.extend(dataparser_params)
 
         # Create experiment log directory
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        experiment_log_dir = os.path.join(data_path, experiment_name, method)
-        os.makedirs(experiment_log_dir, exist_ok=True)
+        timestamp = time.strftime("%Y%m%d_%H%M%S")
+        experiment_log_dir = data_path / experiment_name / method
+        experiment_log_dir.mkdir(parents=True, exist_ok=True)
 
         # Create log files
-        log_file = os.path.join(experiment_log_dir, f"training_{timestamp}.log")
-        params_file = os.path.join(experiment_log_dir, f"params_{timestamp}.json")
+        log_file = experiment_log_dir / f"training_{timestamp}.log"
+        params_file = experiment_log_dir / f"params_{timestamp}.json"
 
         # Use conda run method
         training_success = self._try_conda_run(ns_cmd, log_file, params_file, method, base_dir,
-                                               experiment_name, config, timestamp)
+                                               experiment_name, config, timestamp, tee)
 
         # If training succeeded and export is enabled, export appropriate geometry
         if training_success and export_geometry:
@@ -269,12 +367,12 @@ class NerfTrainingLogger:
             print("=" * 60)
 
             # Look for the config.yml file in the experiment directory
-            config_path = os.path.join(experiment_log_dir, "run" ,"config.yml")
+            config_path = experiment_log_dir / "run" / "config.yml"
 
-            if os.path.exists(config_path):
+            if config_path.is_file():
                 if method == "splatfacto":
                     print("📊 Exporting Gaussian Splat for splatfacto model...")
-                    export_success = self.export_gaussian_splat(config_path, experiment_log_dir)
+                    export_success = self.export_gaussian_splat(config_path, experiment_log_dir, tee=tee)
                     if export_success:
                         print("✅ Gaussian splat export completed successfully!")
                     else:
@@ -288,7 +386,8 @@ class NerfTrainingLogger:
                         num_points=pointcloud_params["num_points"],
                         remove_outliers=pointcloud_params["remove_outliers"],
                         normal_method=pointcloud_params["normal_method"],
-                        save_world_frame=pointcloud_params["save_world_frame"]
+                        save_world_frame=pointcloud_params["save_world_frame"],
+                        tee=tee
                     )
                     if export_success:
                         print("✅ Pointcloud export completed successfully!")
@@ -305,9 +404,9 @@ class NerfTrainingLogger:
 
         return training_success
 
-    def _try_conda_run(self, ns_cmd: List[str], log_file: str, params_file: str,
+    def _try_conda_run(self, ns_cmd: List[str], log_file: Path, params_file: Path,
                        method: str, base_dir: str, experiment_name: str,
-                       config: List[str], timestamp: str) -> bool:
+                       config: List[str], timestamp: str, tee: bool = True) -> bool:
         """Try using conda run command"""
         conda_prefix = self.get_conda_command_prefix()
 
@@ -318,14 +417,15 @@ class NerfTrainingLogger:
             cmd = conda_prefix + ns_cmd
 
         return self._execute_training(cmd, log_file, params_file, method, base_dir,
-                                      experiment_name, config, timestamp)
+                                      experiment_name, config, timestamp, tee)
 
-    def _execute_training(self, cmd: List[str], log_file: str, params_file: str,
+    def _execute_training(self, cmd: List[str], log_file: Path, params_file: Path,
                           method: str, base_dir: str, experiment_name: str,
-                          config: List[str], timestamp: str) -> bool:
+                          config: List[str], timestamp: str, tee: bool = True) -> bool:
         """Execute the training command and handle logging"""
+        cmd_str = shlex.join(cmd)
 
-        # Log parameters
+        # Parameters are written to params_file once training has finished
         params_data = {
             "timestamp": timestamp,
             "method": method,
@@ -333,52 +433,29 @@ class NerfTrainingLogger:
             "experiment_name": experiment_name,
             "config": config,
             "conda_environment": self.conda_env,
-            "command": " ".join(cmd)
+            "command": cmd_str
         }
 
-        with open(params_file, 'w') as f:
-            json.dump(params_data, f, indent=2)
-
         print(f"Starting training: {method}")
-        print(f"Command: {' '.join(cmd)}")
-        print(f"Logs will be saved to: {os.path.dirname(log_file)}")
-
-        start_time = time.time()
+        print(f"Command: {cmd_str}")
+        print(f"Logs will be saved to: {log_file.parent}")
 
         try:
-            with open(log_file, 'w') as f:
-                f.write(f"=== TRAINING START ===\n")
-                f.write(f"Command: {' '.join(cmd)}\n")
-                f.write(f"Conda Environment: {self.conda_env}\n")
-                f.write(f"{'=' * 50}\n\n")
-
-                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
-                                           universal_newlines=True, bufsize=1)
-
-                for line in process.stdout:
-                    print(line, end='')
-                    f.write(line)
-                    f.flush()
-
-            process.wait()
-            end_time = time.time()
-            duration = end_time - start_time
-
-            with open(log_file, 'a') as f:
-                f.write(f"\n{'=' * 50}\n")
-                f.write(f"Duration: {duration:.2f}s ({duration / 60:.2f} minutes)\n")
-                f.write(f"Return code: {process.returncode}\n")
+            returncode, duration = self._run_logged(cmd, log_file, [
+                "=== TRAINING START ===",
+                f"Command: {cmd_str}",
+            ], tee)
 
             params_data["duration_seconds"] = duration
-            params_data["return_code"] = process.returncode
+            params_data["return_code"] = returncode
 
             with open(params_file, 'w') as f:
                 json.dump(params_data, f, indent=2)
 
             print(f"\nCompleted in {duration:.2f}s")
-            print(f"Logs saved to: {os.path.dirname(log_file)}")
+            print(f"Logs saved to: {log_file.parent}")
 
-            return process.returncode == 0
+            return returncode == 0
 
         except Exception as e:
             print(f"Training execution failed: {e}")
@@ -402,10 +479,10 @@ if __name__ == "__main__":
     base_dir = "/home/sebastian/repos/master_thesis/test/shelf/0"
     experiment = "nerf_for_eval"
     config = [
-        "--pipeline.model.camera-optimizer.mode off",
-        "--pipeline.datamanager.images-on-gpu True",
-        "--timestamp run",
-        "--downscale-factor 4"
+        "--pipeline.model.camera-optimizer.mode", "off",
+        "--pipeline.datamanager.images-on-gpu", "True",
+        "--timestamp", "run",
+        "--downscale-factor", "4"
     ]
 
     # Train with automatic gaussian splat export (default behavior for splatfacto)
@@ -420,7 +497,7 @@ if __name__ == "__main__":
     experiment_log_dir = os.path.join(data_path, experiment, method)
     config_path = os.path.join(experiment_log_dir, "run", "config.yml")
     print("📊 Exporting Gaussian Splat for splatfacto model...")
-    export_success = logger.export_gaussian_splat(config_path, experiment_log_dir)
+    export_success = logger.export_gaussian_splat(config_path, experiment_log_dir, tee=False)
     if export_success:
         print("✅ Gaussian splat export completed successfully!")
     else: